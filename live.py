@@ -1,15 +1,27 @@
-import json
+import logging
+import time
+
+import orjson
 from websocket import WebSocketApp
-import collections
+from sortedcontainers import SortedDict
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between printed book summaries per symbol; per-message
+# printing dominates the receive path on busy feeds
+_REPORT_INTERVAL = 0.1
 
 
 class DepthSnapshot:
     """Class to manage and update market depth snapshots."""
 
     def __init__(self):
-        """Initialize ordered dictionaries for bids and asks."""
-        self.bids = collections.OrderedDict()
-        self.asks = collections.OrderedDict()
+        """Initialize price-sorted dictionaries for bids and asks."""
+        # SortedDict keeps the levels ordered by price, so best bid/ask
+        # reads the end of the key view instead of an O(N) max/min scan
+        self.bids = SortedDict()
+        self.asks = SortedDict()
+        self._last_report = 0.0
 
     @staticmethod
     def update_items(items, msg_side):
@@ -40,15 +52,20 @@ class DepthSnapshot:
             self.asks.clear()
         DepthSnapshot.update_items(self.bids, market_depth['Bids'])
         DepthSnapshot.update_items(self.asks, market_depth['Asks'])
-        print("Best bid:", max(self.bids) if self.bids else "None",
-              "Best ask:", min(self.asks) if self.asks else "None")
+
+    def report(self):
+        """Print the book state at most every _REPORT_INTERVAL seconds."""
+        now = time.monotonic()
+        if now - self._last_report >= _REPORT_INTERVAL:
+            self._last_report = now
+            self.print_state()
 
     def print_state(self):
         """Print the current state of bids and asks."""
         print('Bids:', self.bids)
         print('Asks:', self.asks)
         if self.bids and self.asks:
-            print('Best Bid/Ask:', max(self.bids), '/', min(self.asks))
+            print('Best Bid/Ask:', self.bids.keys()[-1], '/', self.asks.keys()[0])
         else:
             print('No valid bids or asks.')
 
@@ -56,6 +73,13 @@ class DepthSnapshot:
 # List of symbols to subscribe for market data
 symbols = ['BTC-PERPETUAL@DERIBIT', 'BTC-USD@DYDX_V4', 'BTCUSDT@BYBIT_SPOT']
 
+# The subscription payloads are identical on every (re)connect, so
+# serialize them once at import instead of in on_open
+_SUBS = [orjson.dumps({"Message": {"SymbolsRequest": {}}}).decode()]
+for _symbol in symbols:
+    _SUBS.append(orjson.dumps({'Message': {'MarketDepth': {'Symbol': _symbol}}}).decode())
+    _SUBS.append(orjson.dumps({'Message': {'PublicTrades': {'Symbol': _symbol}}}).decode())
+
 
 def on_error(ws, error):
     """Handle errors in the WebSocket connection.
@@ -73,15 +97,9 @@ def on_open(ws):
     Args:
         ws (WebSocketApp): WebSocket application instance.
     """
-    message = {"Message": {"SymbolsRequest": {}}}
-    ws.send(json.dumps(message))
-
-    for symbol in symbols:
-        # Subscribe to symbols request on open
-        depth = json.dumps({'Message': {'MarketDepth': {'Symbol': symbol}}})
-        trade = json.dumps({'Message': {'PublicTrades': {'Symbol': symbol}}})
-        ws.send(depth)
-        ws.send(trade)
+    for payload in _SUBS:
+        # Send the precomputed symbols request and per-symbol subscriptions
+        ws.send(payload)
 
 
 # Dictionary to keep track of depth snapshots for each symbol
@@ -95,7 +113,9 @@ def on_message(ws, data):
         ws (WebSocketApp): WebSocket application instance.
         data (str): Message data received.
     """
-    msg = json.loads(data)
+    # orjson decodes these dict-heavy frames several times faster than the
+    # stdlib json module and accepts bytes frames without an extra decode
+    msg = orjson.loads(data)
     if 'MarketDepth' in msg:
         # Handle market depth updates
         symbol = msg['MarketDepth']['Symbol']
@@ -103,13 +123,13 @@ def on_message(ws, data):
             depths[symbol] = DepthSnapshot()
         depth = depths[symbol]
         depth.update(msg)
-        depth.print_state()
+        depth.report()
     elif 'PublicTrade' in msg:
         # Handle public trade messages
-        print("Public Trade:", msg)
+        logger.debug("Public Trade: %s", msg)
     elif 'Symbols' in msg:
         # Handle symbols response
-        print("Symbols:", msg)
+        logger.debug("Symbols: %s", msg)
 
 
 # Start the WebSocket connection